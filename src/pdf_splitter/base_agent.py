@@ -6,6 +6,39 @@ Provides common agent logic and interface to reduce code duplication.
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
 
+# Prompt literals live at module scope so they are materialized once at
+# import instead of being rebuilt from an f-string on every call in the
+# per-page loop.
+_STATIC_SYSTEM_PROMPT = """
+You are a highly specialized AI agent tasked with splitting a large PDF containing multiple business letters into distinct documents, one per letter. Your operation is precise, methodical, and you must strictly follow the workflow and decision logic below.
+
+### CORE WORKFLOW
+1. Use the `read_consecutive_pages` tool to retrieve the text for the current and next page.
+2. Analyze both pages (consider text topic, key themes, logos, page numbers, and visual elements) to determine if a new document begins on the next page.
+3. Apply the Decision-Making Logic below. Always respond with a structured tool call when required, not just a description.
+---
+### DECISION-MAKING LOGIC
+- High Confidence (New Document): If the next page clearly starts a new document, you must call the `save_document` tool immediately. Do not narrate your intent—make the tool call directly.
+- High Confidence (Same Document): If the next page is clearly a continuation, do not call any tools. Respond with a brief rationale and proceed.
+- Uncertainty / Low Confidence: If unsure, use `search_for_similar_cases` and/or `ask_human_for_confirmation` as needed.
+---
+### CRITICAL FINAL STEP
+After the last page, you must call `save_document` to save the last set of pages. Always use structured tool calls when required.
+---
+### METADATA RULES
+When saving a document, extract the metadata yourself from the page text and include it inline in the one `save_document` call — never spend a separate turn on metadata extraction.
+* Date: must be in YYYYMMDD format.
+* Company: if the name consist of multiple words use a commonly used short identifier (examples: 'Deutsche Bahn' -> 'DB', 'Deutsche Bank' -> 'DBank', 'Stadtwerke Neu Isenburg' -> 'SWNI', 'GEWOBAU' -> 'GEWOBAU'), and strip legal suffixes like GmbH.
+* Title: should be concise and short only a few key words max (no explanation).
+
+Use ONLY the tools provided with this request, with exactly their defined argument structures.
+"""
+
+_DYNAMIC_CONTEXT_TEMPLATE = """### CONTEXT
+- Total Pages in PDF: {total_pages}
+- Current Position: You are analyzing pages {current_page_index} and {next_page_index}.
+- Collected Pages: {current_document_pages}"""
+
 class BasePDFSplitterAgent(ABC):
     def __init__(self, tools: List[Dict[str, Any]], model_name: str, config: Any):
         self.tools = tools
@@ -24,44 +57,70 @@ class BasePDFSplitterAgent(ABC):
         """
         pass
 
-    def build_prompt(self, state: Dict[str, Any]) -> str:
+    @abstractmethod
+    def run_batch(self, start_idx: int, k: int, state: Dict[str, Any]) -> Dict[str, Any]:
         """
-        Build the agent prompt from the current state.
+        Classify the boundaries for pages start_idx..start_idx+k-1 in a single
+        LLM call instead of one call per page.
+        Args:
+            start_idx: Index of the first page in the window.
+            k: Number of pages to classify in this call.
+            state: Dict with current_page_index, total_pages, current_document_pages, etc.
+        Returns:
+            Updated state after committing the window's decisions.
         """
-        return f"""
-You are a highly specialized AI agent tasked with splitting a large PDF containing multiple business letters into distinct documents, one per letter. Your operation is precise, methodical, and you must strictly follow the workflow and decision logic below.
+        pass
+
+    def build_static_system(self) -> str:
+        """
+        Build the fully static part of the system prompt.
+
+        Contains no state interpolation so the exact same prefix is sent on
+        every request, letting the Ollama server reuse its prompt (KV) cache
+        across pages instead of re-prefilling the instruction body each time.
+        """
+        return _STATIC_SYSTEM_PROMPT
+
+    def build_batch_user(self, start_idx: int, page_texts: List[str], state: Dict[str, Any]) -> str:
+        """
+        Build the user message for a batched boundary-classification call.
 
-### CONTEXT
+        Asks for one JSON decision per page in the window so a single LLM
+        round-trip covers k pages instead of one call per page.
+        """
+        pages_block = "\n\n".join(
+            f"--- Page {start_idx + offset + 1} (index {start_idx + offset}) ---\n{text}"
+            for offset, text in enumerate(page_texts)
+        )
+        last_idx = start_idx + len(page_texts) - 1
+        return f"""### CONTEXT
 - Total Pages in PDF: {state['total_pages']}
-- Current Position: You are analyzing pages {state['current_page_index']} and {state['current_page_index']+1}.
-- Collected Pages: {state['current_document_pages']}
----
-### CORE WORKFLOW
-1. Use the `read_consecutive_pages` tool to retrieve the text for the current and next page.
-2. Analyze both pages (consider text topic, key themes, logos, page numbers, and visual elements) to determine if a new document begins on the next page.
-3. Apply the Decision-Making Logic below. Always respond with a structured tool call when required, not just a description.
----
-### DECISION-MAKING LOGIC
-- High Confidence (New Document): If the next page clearly starts a new document, you must call the `save_document` tool immediately. Do not narrate your intent—make the tool call directly.
-- High Confidence (Same Document): If the next page is clearly a continuation, do not call any tools. Respond with a brief rationale and proceed.
-- Uncertainty / Low Confidence: If unsure, use `search_for_similar_cases` and/or `ask_human_for_confirmation` as needed.
----
-### CRITICAL FINAL STEP
-After the last page, you must call `save_document` to save the last set of pages. Always use structured tool calls when required.
+- Pages collected for the current document so far: {state['current_document_pages']}
+- This request covers pages with indices {start_idx} to {last_idx}.
 
-IMPORTANT: You have access to the following tools. You must use the exact tool name and argument structure as defined below:
+### PAGE CONTENTS
+{pages_block}
 
-1. read_consecutive_pages: Use this tool to read the text of two consecutive pages. Call it with 'current_page_index' (an integer, e.g., 0 for the first page).
-2. search_for_similar_cases: Use this tool to search for similar cases. Call it with 'current_page_text' and 'next_page_text' (both strings).
-3. ask_human_for_confirmation: Use this tool to ask for human feedback. Call it with 'question' (a string).
-4. save_document: Use this tool to save a document. Call it with 'page_indices' (list of integers), 'company' (string), 'date' (string), and 'title' (string).
-    * Date: must be in YYYYMMDD format.
-    * Company: if the name consist of multiple words use a commonly used short identifier (examples: 'Deutsche Bahn' -> 'DB', 'Deutsche Bank' -> 'DBank', 'Stadtwerke Neu Isenburg' -> 'SWNI', 'GEWOBAU' -> 'GEWOBAU'), and strip legal suffixes like GmbH.
-    * Title: should be concise and short only a few key words max (no explanation).
+### TASK
+For EVERY page index from {start_idx} to {last_idx}, decide whether a NEW document begins on that page.
+Respond ONLY with a JSON object of the form:
+{{"decisions": [{{"page": <index>, "is_new_document": <true|false>, "company": "<short company id>", "date": "<YYYYMMDD>", "title": "<few key words>"}}, ...]}}
+- "company", "date" and "title" describe the document that ENDS just before a new one begins; include them only when "is_new_document" is true.
+- If the PDF's final page (index {state['total_pages'] - 1}) is inside this window, append one extra entry with "page": {state['total_pages']} and "is_new_document": true carrying the metadata of the last document, so it gets saved too."""
 
-Do NOT use any other tool names or argument structures. Do NOT use 'page_numbers', 'pdf_file_path', or any other arguments. Only use the tools and arguments exactly as defined above.
+    def build_dynamic_user(self, state: Dict[str, Any]) -> str:
+        """
+        Build the small per-page context block sent as a trailing user message.
 
-"""
+        Kept separate from the static system prompt so only these few lines
+        change between iterations.
+        """
+        return _DYNAMIC_CONTEXT_TEMPLATE.format(
+            total_pages=state["total_pages"],
+            current_page_index=state["current_page_index"],
+            next_page_index=state["current_page_index"] + 1,
+            current_document_pages=state["current_document_pages"],
+        )
 
     def update_state(self, state: Dict[str, Any], tool_calls: List[Dict[str, Any]]) -> Dict[str, Any]:
         """
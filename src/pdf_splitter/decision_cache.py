@@ -0,0 +1,45 @@
+# src/pdf_splitter/decision_cache.py
+"""
+In-memory cache for per-page boundary decisions.
+
+Multi-letter PDFs repeat a lot of structure (letterheads, boilerplate,
+separator sheets), so the agent keeps re-deciding the same page-pair shapes.
+Caching the final decision keyed by a hash of the adjacent page texts lets
+repeated pairs skip the LLM call entirely.
+"""
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache mapping a (previous page text, current page text) pair
+    to the boundary decision the agent made for it.
+    """
+
+    def __init__(self, maxsize: int = 1024, truncate: int = 2000):
+        self.maxsize = maxsize
+        # Page texts are hashed on a truncated prefix: the head of a page
+        # (letterhead, date line, subject) carries the boundary signal, and
+        # truncation keeps hashing cost independent of page length.
+        self.truncate = truncate
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def key(self, prev_text: str, curr_text: str) -> str:
+        combined = prev_text[: self.truncate] + "\x00" + curr_text[: self.truncate]
+        return hashlib.blake2b(combined.encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+    def get(self, prev_text: str, curr_text: str) -> Optional[Dict[str, Any]]:
+        key = self.key(prev_text, curr_text)
+        decision = self._entries.get(key)
+        if decision is not None:
+            self._entries.move_to_end(key)
+        return decision
+
+    def put(self, prev_text: str, curr_text: str, decision: Dict[str, Any]) -> None:
+        key = self.key(prev_text, curr_text)
+        self._entries[key] = decision
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
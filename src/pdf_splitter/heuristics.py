@@ -0,0 +1,95 @@
+# src/pdf_splitter/heuristics.py
+"""
+Cheap lexical pre-filter for "obvious continuation" pages.
+
+Business-letter boundaries almost always announce themselves: a fresh date
+line, a letterhead/title near the top, a previous page that ended on a full
+sentence. Pages without any of those signals can be classified as
+continuations locally, keeping the LLM for the ambiguous cases only.
+"""
+import re
+from functools import lru_cache
+from typing import FrozenSet
+
+# A date near the top of a page (German or ISO style) is the strongest
+# new-letter signal in this corpus.
+_DATE_RE = re.compile(r"\b(?:\d{1,2}[./-]\d{1,2}[./-]\d{2,4}|\d{4}-\d{2}-\d{2})\b")
+_WORD_RE = re.compile(r"[A-Za-zÄÖÜäöüß]{3,}")
+# Sentence-final punctuation; a previous page ending without it was cut
+# mid-sentence and the next page continues it.
+_SENTENCE_END = (".", "!", "?", ":", ";")
+# Closing formulas: a page ending in one of these (or in a short name
+# line below one) is a letter's LAST page, not a mid-sentence cut.
+_CLOSING_RE = re.compile(
+    r"(?:mit\s+freundlichen\s+gr(?:ü|u)(?:ß|ss)en|freundliche\s+gr(?:ü|u)(?:ß|ss)e"
+    r"|hochachtungsvoll|viele\s+gr(?:ü|u)(?:ß|ss)e|(?:kind|best)\s+regards|sincerely)",
+    re.IGNORECASE,
+)
+
+
+def _head_lines(text: str, n: int = 3):
+    return [line.strip() for line in text.splitlines()[:n] if line.strip()]
+
+
+def _ends_like_signature(text: str) -> bool:
+    # Business letters end in a closing formula plus a short name line,
+    # neither of which carries sentence punctuation — without this check
+    # nearly every true boundary would count as "cut mid-sentence".
+    tail = [line.strip() for line in text.splitlines() if line.strip()][-4:]
+    if any(_CLOSING_RE.search(line) for line in tail):
+        return True
+    words = tail[-1].split() if tail else []
+    return 0 < len(words) <= 4 and all(w[:1].isupper() for w in words)
+
+
+@lru_cache(maxsize=256)
+def _tokens(text: str, limit: int = 2000) -> FrozenSet[str]:
+    # Memoized: each page appears in two adjacent (prev, curr) pairs, so
+    # without the cache every page would be tokenized twice.
+    return frozenset(w.lower() for w in _WORD_RE.findall(text[:limit]))
+
+
+def likely_same_document(prev: str, curr: str) -> float:
+    """
+    Score in [0, 1] for how likely `curr` continues the document `prev`
+    belongs to. Scores above ~0.9 are safe to treat as continuations
+    without consulting the LLM.
+    """
+    if not curr.strip():
+        # Blank/whitespace-only pages never start a letter.
+        return 0.95
+
+    score = 0.5
+    head = _head_lines(curr)
+
+    # Fresh date near the top strongly suggests a new letter.
+    if any(_DATE_RE.search(line) for line in head):
+        score -= 0.3
+    else:
+        score += 0.15
+
+    # An ALL-CAPS or letterhead-style line in the first lines suggests a
+    # new document's title block.
+    if any(line.isupper() and len(line) > 3 for line in head):
+        score -= 0.2
+    else:
+        score += 0.1
+
+    # Previous page ending mid-sentence means the text flows across the
+    # page break — but a signature block also ends without punctuation,
+    # and that marks a letter's end rather than a continuation.
+    prev_stripped = prev.rstrip()
+    if (
+        prev_stripped
+        and not prev_stripped.endswith(_SENTENCE_END)
+        and not _ends_like_signature(prev_stripped)
+    ):
+        score += 0.25
+
+    # Vocabulary overlap between the two pages.
+    prev_tokens, curr_tokens = _tokens(prev), _tokens(curr)
+    if prev_tokens and curr_tokens:
+        jaccard = len(prev_tokens & curr_tokens) / len(prev_tokens | curr_tokens)
+        score += min(jaccard, 0.3)
+
+    return max(0.0, min(1.0, score))
@@ -1,58 +1,81 @@
 # src/pdf_splitter/main.py
 
+import asyncio
+import hashlib
+import logging
 import os
 import sys
-from PyPDF2 import PdfReader
-from . import config
+from .config import CFG
 from .ollama_agent import OllamaPDFSplitterAgent
+from .tools import preload_pages
+
+
+async def split_pdf(agent, state):
+    """
+    Walk the PDF in BATCH_PAGES windows, keeping up to LOOKAHEAD_BATCHES
+    classification calls in flight so network and prefill latency overlap.
+    Boundary decisions are committed strictly in page order.
+    """
+    try:
+        starts = list(range(0, state["total_pages"], CFG.batch_pages))
+        pending = {}
+        scheduled = 0
+        for idx, start in enumerate(starts):
+            while scheduled < len(starts) and scheduled < idx + CFG.lookahead_batches:
+                s = starts[scheduled]
+                pending[s] = asyncio.create_task(agent.classify_batch(s, CFG.batch_pages, state))
+                scheduled += 1
+            by_page, end_idx, last = await pending.pop(start)
+            state = agent.commit_batch(by_page, start, end_idx, last, state)
+            print(f"Current Page Index: {state['current_page_index']}")
+            print(f"Pages for current doc: {state['current_document_pages']}")
+            print("\n" + "="*50 + "\n")
+        # The last document must not depend on the model emitting the
+        # sentinel entry; flush whatever is still collected.
+        return agent.flush_remaining(state)
+    finally:
+        await agent.aclose()
 
 if __name__ == "__main__":
     # 1. Initial Setup
-    print(f"Attempting to connect to Ollama at: {config.OLLAMA_HOST}")
-    os.makedirs(config.OUTPUT_DIR, exist_ok=True)
-    if not os.path.exists(config.PDF_PATH):
-        print(f"Error: PDF file not found at '{config.PDF_PATH}'. Please update the path.")
+    # Diagnostics go through logging so their formatting cost is skipped
+    # unless the level is enabled; progress output stays on stdout.
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"))
+    print(f"Attempting to connect to Ollama at: {CFG.ollama_host}")
+    os.makedirs(CFG.output_dir, exist_ok=True)
+    if not os.path.exists(CFG.pdf_path):
+        print(f"Error: PDF file not found at '{CFG.pdf_path}'. Please update the path.")
         sys.exit(1)
-    if not config.MONGO_URI:
+    if not CFG.mongo_uri:
         print("Warning: MONGO_URI not set. The agent cannot learn from feedback.")
 
     try:
         # 2. PDF and Agent Setup
-        reader = PdfReader(config.PDF_PATH)
-        total_pages = len(reader.pages)
+        pages = preload_pages()
+        total_pages = len(pages)
         print(f"Processing PDF with {total_pages} pages...")
 
-        agent = OllamaPDFSplitterAgent(config)
+        agent = OllamaPDFSplitterAgent(CFG)
 
         # 3. Initial State
+        # Page texts themselves are served by tools.get_page_text from the
+        # preloaded list; state only carries derived data.
         state = {
             "current_page_index": 0,
             "total_pages": total_pages,
             "current_document_pages": [0],
+            # Cheap per-page digests let the agent auto-classify repeated
+            # boilerplate (blank pages, separator sheets) without an LLM call.
+            "page_hashes": [
+                hashlib.blake2b(p.encode("utf-8", "replace"), digest_size=16).digest() for p in pages
+            ],
         }
-        messages = [{"role": "user", "content": "Start processing the PDF. Please split it into logical documents."}]
-
         # 4. Run agent loop
-        os.system('cls' if os.name == 'nt' else 'clear')
-        while state["current_page_index"] < state["total_pages"]:
-            result = agent.run(messages, state)
-            messages = result["messages"]
-            state = result["state"]
-            print(f"Current Page Index: {state['current_page_index']}")
-            print(f"Pages for current doc: {state['current_document_pages']}")
-            print("Last message:", messages[-1]["content"])
-            print("\n" + "="*50 + "\n")
+        state = asyncio.run(split_pdf(agent, state))
 
         print("PDF splitting process complete!")
     except FileNotFoundError:
-        print(f"Error: The file '{config.PDF_PATH}' was not found.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        import traceback
-        traceback.print_exc()
-
-    except FileNotFoundError:
-        print(f"Error: The file '{config.PDF_PATH}' was not found.")
+        print(f"Error: The file '{CFG.pdf_path}' was not found.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         import traceback
@@ -1,13 +1,32 @@
 # src/pdf_splitter/ollama_agent.py
 """
-PDF splitting agent using native Ollama Python library with tool/function calling (llama3.1:8b).
+PDF splitting agent using the native Ollama Python library with tool/function calling.
 """
 
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+
+import httpx
 import ollama
+import orjson
 from typing import List, Dict, Any
-from . import config
-from .tools import read_consecutive_pages, search_for_similar_cases, ask_human_for_confirmation, save_document
+from .tools import (
+    read_consecutive_pages,
+    search_for_similar_cases,
+    ask_human_for_confirmation,
+    save_document,
+    get_page_text,
+    extract_metadata,
+    EMBEDDINGS,
+)
 from .base_agent import BasePDFSplitterAgent
+from .decision_cache import DecisionCache
+from .heuristics import likely_same_document
+
+logger = logging.getLogger(__name__)
 
 ollama_tools = [
     {
@@ -46,7 +65,7 @@ ollama_tools = [
     },
     {
         "name": "save_document",
-        "description": "Saves the specified pages as a new PDF document with a dynamically generated name based on company, date, and title.",
+        "description": "Saves the specified pages as a new PDF document. company, date and title are extracted from the page text and passed inline in this single call; there is no separate metadata-extraction step.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -60,67 +79,404 @@ ollama_tools = [
     }
 ]
 
+# Sent on the second attempt of a failed batch parse; resending the
+# identical temperature-0 request would just reproduce the same reply.
+_REPAIR_PROMPT = (
+    "Your previous reply could not be parsed. Respond again with ONLY a JSON "
+    'object of the form {"decisions": [...]} exactly as instructed, with no other text.'
+)
+
+# Precomputed O(1) dispatch map; the functions are module-level and
+# stateless, so there is no reason to rebuild this per agent instance.
+TOOLS = {
+    fn.__name__: fn
+    for fn in (read_consecutive_pages, search_for_similar_cases, ask_human_for_confirmation, save_document)
+}
+
 class OllamaPDFSplitterAgent(BasePDFSplitterAgent):
     def __init__(self, config):
-        super().__init__(tools=ollama_tools, model_name=config.OLLAMA_MODEL, config=config)
-        self.client = ollama.Client(host=config.OLLAMA_HOST)
+        super().__init__(tools=ollama_tools, model_name=config.ollama_model, config=config)
+        # ollama.Client forwards extra kwargs to its internal httpx.Client,
+        # so configure a keep-alive pool here and reuse the same TCP
+        # connection for every page instead of paying setup per request.
+        self.client = ollama.Client(
+            host=config.ollama_host,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300),
+            timeout=httpx.Timeout(600.0),
+        )
+        # Async twin of the client above, used to keep several batch windows
+        # in flight at once while decisions are committed in page order.
+        self.async_client = ollama.AsyncClient(
+            host=config.ollama_host,
+            limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300),
+            timeout=httpx.Timeout(600.0),
+        )
+        # Built once: the static system prompt is byte-identical across all
+        # pages so the Ollama server can reuse its KV cache for the prefix.
+        self._static_sys = self.build_static_system()
+        # The chat message wrapping it is just as static; reusing one dict
+        # avoids rebuilding (and re-encoding) it on every request.
+        self._system_msg = {"role": "system", "content": self._static_sys}
+        # Greedy, capped decoding: boundary classification is a routing task
+        # that gains nothing from sampling, and num_predict bounds decode
+        # latency. keep_alive pins the model so no request pays a cold reload.
+        self._chat_options = {
+            "num_predict": 256,
+            "temperature": 0.0,
+            "top_p": 0.1,
+            "num_ctx": 4096,
+            "num_thread": os.cpu_count(),
+        }
+        self._keep_alive = "30m"
+        # Boundary routing can run on a smaller/cheaper model than the main
+        # one; metadata-bearing tool turns keep using model_name.
+        self.router_model = getattr(config, "router_model", None) or self.model_name
+        self._decision_cache = DecisionCache()
+        # Runs tool calls off the streaming thread so PDF/Mongo I/O overlaps
+        # with the model still decoding the rest of its answer.
+        self._tool_pool = concurrent.futures.ThreadPoolExecutor(max_workers=4)
+        self.warmup()
+
+    def warmup(self) -> None:
+        """
+        Fire a trivial chat and embedding request so Ollama loads the models
+        now instead of stalling the first real classification by several
+        seconds. Failures are non-fatal: the first real call will surface
+        any connectivity problem with proper context.
+        """
+        for model in {self.model_name, self.router_model}:
+            try:
+                self.client.chat(
+                    model=model,
+                    messages=[{"role": "user", "content": "ok"}],
+                    stream=False,
+                    options={"num_predict": 1},
+                    keep_alive=self._keep_alive,
+                )
+            except Exception as e:
+                logger.debug("Chat warmup for %s failed: %s", model, e)
+        try:
+            EMBEDDINGS.client.embeddings(model=EMBEDDINGS.model, prompt="ok")
+        except Exception as e:
+            logger.debug("Embedding warmup failed: %s", e)
+
+    def close(self) -> None:
+        """Release the pooled HTTP connection held by the sync Ollama client."""
+        self._tool_pool.shutdown(wait=True)
+        self.client._client.close()
+
+    async def aclose(self) -> None:
+        """Release the HTTP connections of both the sync and async clients."""
+        self._tool_pool.shutdown(wait=True)
+        self.client._client.close()
+        await self.async_client._client.aclose()
+
+    def _prepare_batch(self, start_idx: int, k: int, state: Dict[str, Any]):
+        """
+        Assemble everything a batch classification needs before the LLM call:
+        window bounds, the per-page (prev, curr) text pairs, locally decided
+        pages (decision cache + hash dedupe) and the chat request — or None
+        as the request when every page was decided locally.
+        """
+        end_idx = min(start_idx + k, state["total_pages"])
+        # The sentinel entry at index == total_pages flushes the last document
+        # when this window contains the final page.
+        last = end_idx + 1 if end_idx == state["total_pages"] else end_idx
+
+        # Decisions depend only on each adjacent page pair, so a window whose
+        # pairs were all seen before can be answered from the cache without
+        # an LLM call.
+        pairs = {
+            page: (get_page_text(page - 1) if page > 0 else "", get_page_text(page))
+            for page in range(start_idx, last)
+        }
+        cached = {page: self._decision_cache.get(*pair) for page, pair in pairs.items()}
+        # A page byte-identical to its predecessor (blank page, separator
+        # sheet, repeated boilerplate) is always a continuation; decide it
+        # from the precomputed hashes without involving the model.
+        page_hashes = state.get("page_hashes")
+        if page_hashes:
+            for page in pairs:
+                if 0 < page < len(page_hashes) and page_hashes[page] == page_hashes[page - 1]:
+                    cached[page] = {"is_new_document": False}
+        # Cheap lexical pre-filter: pages that obviously continue the
+        # previous one (no date header, no title block, text flowing across
+        # the break) never reach the model. The sentinel page is exempt
+        # because it must carry the final document's metadata.
+        threshold = getattr(self.config, "heuristic_threshold", 1.1)
+        for page, (prev_text, curr_text) in pairs.items():
+            if (
+                cached[page] is None
+                and 0 < page < state["total_pages"]
+                and likely_same_document(prev_text, curr_text) >= threshold
+            ):
+                cached[page] = {"is_new_document": False}
+
+        if cached and all(d is not None for d in cached.values()):
+            ollama_request = None
+        else:
+            page_texts = [get_page_text(i) for i in range(start_idx, end_idx)]
+            user_content = self.build_batch_user(start_idx, page_texts, state)
+            ollama_request = {
+                "model": self.router_model,
+                "messages": [
+                    self._system_msg,
+                    {"role": "user", "content": user_content},
+                ],
+                "format": "json",
+                "stream": False,
+                # A window of k decisions needs more output room than a single
+                # tool call, so scale the decode cap with the window size.
+                # num_ctx scales too: OCR'd pages run 400-800 tokens each, and
+                # an overflowing context is truncated silently, degrading the
+                # decisions with no error. ~1k tokens per page plus headroom
+                # for the system prompt and the JSON answer.
+                "options": {
+                    **self._chat_options,
+                    "num_predict": 128 * max(k, 2),
+                    "num_ctx": 2048 + 1024 * max(k, 2),
+                },
+                "keep_alive": self._keep_alive,
+            }
+        return end_idx, last, pairs, cached, ollama_request
+
+    @staticmethod
+    def _parse_batch_content(content: str):
+        """
+        Parse a JSON-mode batch response; returns None when malformed.
+
+        raw_decode from the first '{' tolerates stray text around the
+        object in linear time, without a backtracking regex scan.
+        """
+        start = content.find("{")
+        if start < 0:
+            return None
+        try:
+            parsed, _ = json.JSONDecoder().raw_decode(content, start)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(parsed, dict):
+            return None
+        decisions = parsed.get("decisions", [])
+        return decisions if isinstance(decisions, list) else None
+
+    @staticmethod
+    def _with_repair(ollama_request: Dict[str, Any], content: str) -> Dict[str, Any]:
+        """
+        Derive the retry request for a failed parse: the malformed reply goes
+        back as an assistant turn followed by a repair instruction, so the
+        retry differs from the greedy first attempt instead of reproducing it.
+        """
+        return {
+            **ollama_request,
+            "messages": [
+                *ollama_request["messages"],
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": _REPAIR_PROMPT},
+            ],
+        }
+
+    def _merge_decisions(self, pairs, cached, decisions) -> Dict[int, Dict[str, Any]]:
+        """
+        Fold LLM decisions and locally decided pages into one per-page map and
+        write fresh LLM decisions back to the decision cache.
+        """
+        # A JSON-mode model can still emit non-dict entries (e.g. bare
+        # strings) inside a well-formed decisions array; drop them rather
+        # than letting an AttributeError abort the run.
+        by_page = {
+            d["page"]: d
+            for d in decisions
+            if isinstance(d, dict) and isinstance(d.get("page"), int)
+        }
+        for page, decision in by_page.items():
+            if page in pairs:
+                self._decision_cache.put(*pairs[page], {k_: v for k_, v in decision.items() if k_ != "page"})
+        # Cached and hash-deduped decisions are authoritative for their
+        # pages even when the rest of the window went to the model.
+        for page, decision in cached.items():
+            if decision is not None:
+                by_page[page] = dict(decision, page=page)
+        return by_page
+
+    async def classify_batch(self, start_idx: int, k: int, state: Dict[str, Any]):
+        """
+        Async batch classification: returns (by_page, end_idx, last) without
+        touching state, so several windows can be classified concurrently and
+        committed in order via commit_batch.
+        """
+        end_idx, last, pairs, cached, ollama_request = self._prepare_batch(start_idx, k, state)
+        decisions = []
+        if ollama_request is not None:
+            for attempt in range(2):
+                response = await self.async_client.chat(**ollama_request)
+                content = response.get("message", {}).get("content", "")
+                parsed = self._parse_batch_content(content)
+                if parsed is not None:
+                    decisions = parsed
+                    break
+                logger.warning("Could not parse batch response (attempt %d)", attempt + 1)
+                ollama_request = self._with_repair(ollama_request, content)
+            else:
+                logger.warning("Treating pages %d..%d as continuation after parse failures.", start_idx, end_idx - 1)
+        by_page = self._merge_decisions(pairs, cached, decisions)
+        return by_page, end_idx, last
+
+    def run_batch(self, start_idx: int, k: int, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Classify pages start_idx..start_idx+k-1 in one JSON-mode chat call and
+        commit the boundary decisions locally, without per-page tool turns.
+
+        Synchronous convenience wrapper around classify_batch, so the
+        parse/retry/repair policy lives in exactly one place.
+        """
+        by_page, end_idx, last = asyncio.run(self.classify_batch(start_idx, k, state))
+        return self.commit_batch(by_page, start_idx, end_idx, last, state)
+
+    def commit_batch(
+        self,
+        by_page: Dict[int, Dict[str, Any]],
+        start_idx: int,
+        end_idx: int,
+        last: int,
+        state: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        """
+        Apply a window's boundary decisions to state in page order, saving
+        each finished document locally.
+        """
+        for page in range(start_idx, last):
+            decision = by_page.get(page)
+            if (
+                decision is not None
+                and decision.get("is_new_document")
+                and state["current_document_pages"]
+                and page not in state["current_document_pages"]
+            ):
+                # Lexical extraction from the document's first page backfills
+                # any metadata field the model left out of its decision.
+                fallback = extract_metadata(get_page_text(state["current_document_pages"][0]))
+                result = save_document(
+                    page_indices=state["current_document_pages"],
+                    company=decision.get("company") or fallback["company"],
+                    date=decision.get("date") or fallback["date"],
+                    title=decision.get("title") or fallback["title"],
+                )
+                print(result)
+                state["current_document_pages"] = []
+            # Pages the model skipped in its answer are continuations.
+            if page < state["total_pages"] and page not in state["current_document_pages"]:
+                state["current_document_pages"].append(page)
+
+        state["current_page_index"] = end_idx
+        return state
+
+    def flush_remaining(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Save any pages still collected once every window is committed.
+
+        The sentinel entry normally flushes the last document, but it only
+        exists if the model emits it; this deterministic fallback guarantees
+        the final pages are saved even when the sentinel is missing or the
+        last window's response never parsed, using the lexical metadata
+        extraction for the filename.
+        """
+        if state["current_document_pages"]:
+            metadata = extract_metadata(get_page_text(state["current_document_pages"][0]))
+            result = save_document(
+                page_indices=state["current_document_pages"],
+                company=metadata["company"],
+                date=metadata["date"],
+                title=metadata["title"],
+            )
+            print(result)
+            state["current_document_pages"] = []
+        return state
+
+    def _dispatch_tool(self, name: str, args: Dict[str, Any], state: Dict[str, Any]) -> str:
+        """
+        Execute a single tool call and return the content for its tool
+        message. Tools are plain Python functions (no LangChain @tool
+        decorator) so we call them directly with kwargs provided by the model.
+        """
+        tool_function = TOOLS.get(name)
+        if not tool_function:
+            unknown_tool_message = f"Unknown tool: {name}"
+            logger.warning("Unknown tool: %s", name)
+            return unknown_tool_message
+        try:
+            if name == "read_consecutive_pages":
+                # Default the index from state when the model omits it; the
+                # memoized tool (which piggybacks the metadata block) serves
+                # the rest from the preloaded page list.
+                return read_consecutive_pages(
+                    args.get("current_page_index", state["current_page_index"])
+                )
+            result = tool_function(**args)
+            if isinstance(result, str):
+                return result
+            # Structured results go back to the model as compact canonical
+            # JSON instead of Python repr: cheaper to serialize and fewer
+            # prompt tokens on the next turn.
+            return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).decode()
+        except Exception as e:
+            error_message = f"Error calling tool {name}: {e}"
+            logger.warning("Error calling tool %s: %s", name, e)
+            return error_message
 
     def run(self, messages: List[Dict[str, Any]], state: Dict[str, Any]) -> Dict[str, Any]:
-        prompt = self.build_prompt(state)
         ollama_request = {
             "model": self.model_name,
-            "messages": [{"role": "system", "content": prompt}] + messages,
+            "messages": [
+                self._system_msg,
+                {"role": "user", "content": self.build_dynamic_user(state)},
+            ] + messages,
             "tools": self.tools,
-            "stream": False,
+            "stream": True,
+            "options": self._chat_options,
+            "keep_alive": self._keep_alive,
         }
-        response = self.client.chat(**ollama_request)
-        tool_calls = response.get("message", {}).get("tool_calls") or []
-
-        # Ensure messages list is properly updated
-        response_message = response.get("message", {})
-        if response_message:
-            messages.append(response_message)
-            print(f"[DEBUG] Response message: {response_message.thinking}")
-
-        for call in tool_calls:
-            name = call.get("function", {}).get("name")
-            args = call.get("function", {}).get("arguments", {})
-            
-            if not name:
-                continue
-
-            # Dynamically call the tool function by name. Tools are plain
-            # Python functions (no LangChain @tool decorator) so we call them
-            # directly with kwargs provided by the model.
-            tool_function = globals().get(name)
-            if tool_function:
-                try:
-                    result = tool_function(**args)
-                    # Append tool result to messages
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": call.get("id"),
-                        "name": name,
-                        "content": str(result)
-                    })
-                except Exception as e:
-                    error_message = f"Error calling tool {name}: {e}"
-                    print(error_message)
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": call.get("id"),
-                        "name": name,
-                        "content": error_message
-                    })
-            else:
-                unknown_tool_message = f"Unknown tool: {name}"
-                print(unknown_tool_message)
-                messages.append({
-                    "role": "tool",
-                    "tool_call_id": call.get("id"),
-                    "name": name,
-                    "content": unknown_tool_message
-                })
+        # Stream the response so each tool call is dispatched the moment its
+        # JSON is complete, overlapping tool I/O with the remaining decode.
+        content_parts: List[str] = []
+        tool_calls: List[Dict[str, Any]] = []
+        dispatched = []
+        for chunk in self.client.chat(**ollama_request):
+            message = chunk.get("message", {}) or {}
+            if message.get("content"):
+                content_parts.append(message["content"])
+            for call in message.get("tool_calls") or []:
+                tool_calls.append(call)
+                name = call.get("function", {}).get("name")
+                args = call.get("function", {}).get("arguments", {})
+                # Some model/library combinations deliver arguments as a raw
+                # JSON string rather than a dict.
+                if isinstance(args, (str, bytes)):
+                    try:
+                        args = orjson.loads(args)
+                    except orjson.JSONDecodeError:
+                        args = {}
+                if not name:
+                    continue
+                # ask_human_for_confirmation blocks on stdin; run it inline
+                # after the stream so its prompt doesn't interleave with
+                # decode output or tie up a pool worker.
+                if name == "ask_human_for_confirmation":
+                    dispatched.append((call, name, None, args))
+                else:
+                    dispatched.append(
+                        (call, name, self._tool_pool.submit(self._dispatch_tool, name, args, state), args)
+                    )
+
+        messages.append({"role": "assistant", "content": "".join(content_parts), "tool_calls": tool_calls})
+        for call, name, future, args in dispatched:
+            content = future.result() if future is not None else self._dispatch_tool(name, args, state)
+            messages.append({
+                "role": "tool",
+                "tool_call_id": call.get("id"),
+                "name": name,
+                "content": content
+            })
 
         state = self.update_state(state, tool_calls)
         return {"messages": messages, "state": state}
@@ -1,49 +1,326 @@
 # src/pdf_splitter/tools.py
+import atexit
+import hashlib
 import os
 import re
-from typing import List
-from PyPDF2 import PdfReader, PdfWriter
-# removed langchain.tool decorator import; tools are plain functions for Ollama usage
+import shelve
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional
+import orjson
+import pikepdf
+import pypdfium2 as pdfium
 from pymongo import MongoClient
 from langchain_community.vectorstores import MongoDBAtlasVectorSearch
+import httpx
+import numpy as np
 import ollama
-from . import config
+from .config import CFG
+
+# Embeddings persist across runs keyed by content hash, so re-processing
+# the same PDF (or adjacent-page queries repeating text) skips the Ollama
+# forward pass entirely.
+_EMBED_CACHE_PATH = os.path.expanduser("~/.cache/pdf_splitter/embed.db")
 
 # Minimal Ollama embeddings adapter exposing a small API compatible with
 # the existing vectorstore usage (embed_documents, embed_query). Keeps the
 # rest of the code unchanged and avoids depending on langchain_ollama.
 class OllamaEmbeddingsAdapter:
+    # In-process layer above the shelve file: repeat embeddings within a run
+    # skip even the pickle/disk hit of the persistent cache.
+    _MEM_MAX = 512
+
     def __init__(self, client: ollama.Client, model: str):
         self.client = client
         self.model = model
+        self._shelf = None
+        self._mem: "OrderedDict[str, List[float]]" = OrderedDict()
+        # Guards both cache layers: neither OrderedDict mutation nor shelve
+        # is thread-safe, and calls arrive from the agent's tool pool.
+        self._cache_lock = threading.Lock()
+
+    def _cache(self):
+        if self._shelf is None:
+            os.makedirs(os.path.dirname(_EMBED_CACHE_PATH), exist_ok=True)
+            self._shelf = shelve.open(_EMBED_CACHE_PATH)
+            atexit.register(self._shelf.close)
+        return self._shelf
+
+    def _key(self, text: str) -> str:
+        return hashlib.blake2b((self.model + "\x00" + text).encode("utf-8", "replace"), digest_size=16).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        with self._cache_lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                return hit
+            hit = self._cache().get(key)
+            if hit is not None:
+                self._remember(key, hit)
+            return hit
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        # Caller holds _cache_lock.
+        self._mem[key] = embedding
+        self._mem.move_to_end(key)
+        while len(self._mem) > self._MEM_MAX:
+            self._mem.popitem(last=False)
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        resp = self.client.embeddings(model=self.model, input=texts)
-        embeddings: List[List[float]] = []
-        for item in resp:
-            if isinstance(item, dict) and "embedding" in item:
-                embeddings.append(item["embedding"])
-            else:
-                embeddings.append(item)
+        keys = [self._key(t) for t in texts]
+        embeddings: List[Optional[List[float]]] = [self._lookup(k) for k in keys]
+        # Only the misses go over the wire, in one batched request.
+        miss_indices = [i for i, e in enumerate(embeddings) if e is None]
+        if miss_indices:
+            # client.embed is the batch endpoint (embeddings() takes a single
+            # prompt); its response carries one vector per input, in order.
+            # The network call stays outside the lock.
+            resp = self.client.embed(model=self.model, input=[texts[i] for i in miss_indices])
+            with self._cache_lock:
+                cache = self._cache()
+                for i, vector in zip(miss_indices, resp["embeddings"]):
+                    embeddings[i] = list(vector)
+                    cache[keys[i]] = embeddings[i]
+                    self._remember(keys[i], embeddings[i])
         return embeddings
 
     def embed_query(self, text: str) -> List[float]:
-        resp = self.client.embeddings(model=self.model, input=[text])
-        first = resp[0]
-        if isinstance(first, dict) and "embedding" in first:
-            return first["embedding"]
-        return first
+        # Routed through the module batcher so concurrent queries from the
+        # tool worker pool share one embeddings request.
+        return _EMBED_BATCHER.embed(text)
+
+
+class _EmbedBatcher:
+    """
+    Coalesces embed_query calls arriving from concurrent tool workers into
+    one batched embeddings request, amortizing the HTTP round-trip. The
+    first caller in a window becomes the leader, waits a couple of
+    milliseconds for others to join, then issues a single cache-aware
+    embed_documents call and fans the results out.
+    """
+
+    def __init__(self, adapter: OllamaEmbeddingsAdapter, window: float = 0.002, max_batch: int = 32):
+        self._adapter = adapter
+        self._window = window
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending: List[dict] = []
+
+    def embed(self, text: str) -> List[float]:
+        entry = {"text": text, "event": threading.Event(), "result": None, "error": None}
+        with self._lock:
+            self._pending.append(entry)
+            leader = len(self._pending) == 1
+        if not leader:
+            entry["event"].wait()
+            if entry["error"] is not None:
+                raise entry["error"]
+            return entry["result"]
+
+        time.sleep(self._window)
+        while True:
+            with self._lock:
+                batch = self._pending[: self._max_batch]
+                self._pending = self._pending[self._max_batch:]
+                more = bool(self._pending)
+            try:
+                embeddings = self._adapter.embed_documents([e["text"] for e in batch])
+                for e, embedding in zip(batch, embeddings):
+                    e["result"] = embedding
+            except Exception as exc:
+                for e in batch:
+                    e["error"] = exc
+            finally:
+                for e in batch:
+                    e["event"].set()
+            if not more:
+                break
+        if entry["error"] is not None:
+            raise entry["error"]
+        return entry["result"]
+
+# Initialize embeddings adapter with the Ollama client (host from config).
+# Same keep-alive pool settings as the agent's chat client: ollama.Client
+# forwards the kwargs to its internal httpx.Client, so embedding calls reuse
+# one TCP connection instead of re-handshaking per request.
+_OLLAMA_CLIENT = ollama.Client(
+    host=CFG.ollama_host,
+    limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300),
+    timeout=httpx.Timeout(600.0),
+)
+EMBEDDINGS = OllamaEmbeddingsAdapter(_OLLAMA_CLIENT, model=CFG.ollama_embedding_model)
+_EMBED_BATCHER = _EmbedBatcher(EMBEDDINGS)
+
+# Compiled once; save_document runs per detected document.
+_SANITIZE_RE = re.compile(r'[\W_]+')
+
+# Ensure the output directory once at import rather than per saved
+# document (and regardless of which entry point imported us).
+if CFG.output_dir:
+    os.makedirs(CFG.output_dir, exist_ok=True)
+
+# Lexical metadata extraction. Letters in this corpus carry their date,
+# sender and subject in the first lines, so cheap regexes recover usable
+# filename metadata without an extra LLM turn per document.
+_META_DATE_RE = re.compile(r"\b(\d{1,2})[./-](\d{1,2})[./-](\d{2,4})\b|\b(\d{4})-(\d{2})-(\d{2})\b")
+_SUBJECT_RE = re.compile(r"^(?:betreff|betr\.?|subject|re)\s*:\s*(.+)$", re.IGNORECASE | re.MULTILINE)
+# Legal-form suffixes add nothing to a filename.
+_COMPANY_SUFFIX_RE = re.compile(
+    r"\s*(?:gmbh(?:\s*&\s*co\.?\s*kg)?|mbh|ag|kg|ohg|ug|e\.\s*v\.|se|inc\.?|ltd\.?|llc)\s*$",
+    re.IGNORECASE,
+)
+# Known senders with established short identifiers (same examples the
+# system prompt gives the model). One compiled alternation scans the line
+# once instead of K substring checks; keys are lowercase for the lookup.
+_COMPANY_MAP = {
+    "deutsche bahn": "DB",
+    "deutsche bank": "DBank",
+    "stadtwerke neu isenburg": "SWNI",
+}
+_COMPANY_RE = re.compile("|".join(re.escape(k) for k in _COMPANY_MAP), re.IGNORECASE)
+
+
+def normalize_date(raw: str) -> str:
+    """
+    Normalizes a date string found in page text to YYYYMMDD.
+
+    Args:
+        raw (str): Date in German (18.08.2025), slashed or ISO notation.
+
+    Returns:
+        str: Eight-digit date, or "00000000" if none could be parsed.
+    """
+    match = _META_DATE_RE.search(raw or "")
+    if not match:
+        return "00000000"
+    if match.group(4):  # ISO yyyy-mm-dd
+        year, month, day = match.group(4), match.group(5), match.group(6)
+    else:
+        day, month, year = match.group(1), match.group(2), match.group(3)
+        if len(year) == 2:
+            year = ("19" if int(year) >= 70 else "20") + year
+    # Plain int range checks instead of a datetime round-trip: rejects
+    # number runs that merely look date-shaped (e.g. 31.47.2025).
+    month_i, day_i = int(month), int(day)
+    if not (1 <= month_i <= 12 and 1 <= day_i <= 31):
+        return "00000000"
+    return f"{year}{month_i:02d}{day_i:02d}"
+
 
-# Initialize embeddings adapter with the Ollama client (host from config)
-_OLLAMA_CLIENT = ollama.Client(host=config.OLLAMA_HOST)
-EMBEDDINGS = OllamaEmbeddingsAdapter(_OLLAMA_CLIENT, model=getattr(config, "OLLAMA_EMBEDDING_MODEL", "nomic-embed-text"))
+def shorten_company(name: str) -> str:
+    """
+    Strips legal-form suffixes and trims a sender name for use in filenames.
+
+    Args:
+        name (str): Raw company/sender line from the page head.
+
+    Returns:
+        str: Shortened name, or "Unknown" if nothing usable remains.
+    """
+    match = _COMPANY_RE.search(name or "")
+    if match:
+        return _COMPANY_MAP[match.group(0).lower()]
+    cleaned = _COMPANY_SUFFIX_RE.sub("", (name or "").strip()).strip(" ,;-")
+    return cleaned[:40] if cleaned else "Unknown"
+
+
+def extract_metadata(current_text: str, next_text: str = "") -> Dict[str, str]:
+    """
+    Extracts filename metadata (company, date, title) from page text with
+    cheap lexical rules, as a fallback or cross-check for the LLM's own
+    metadata so no extra model turn is needed per document.
+
+    Args:
+        current_text (str): Text of the page opening the document.
+        next_text (str): Text of the following page (currently unused, kept
+            for callers that pass the full pair).
+
+    Returns:
+        Dict[str, str]: Keys "company", "date" and "title", defaulted when
+        not found.
+    """
+    head_lines = [line.strip() for line in current_text.splitlines()[:10] if line.strip()]
+    company = shorten_company(head_lines[0]) if head_lines else "Unknown"
+    date = normalize_date("\n".join(head_lines))
+    subject = _SUBJECT_RE.search(current_text[:2000])
+    title = subject.group(1).strip()[:60] if subject else "Untitled"
+    return {"company": company, "date": date, "title": title}
+
+
+@lru_cache(maxsize=256)
+def _page_metadata(page_index: int) -> Dict[str, str]:
+    # Each page is revisited at least twice (as curr, then as prev), so the
+    # regex pass runs once per page at most.
+    return extract_metadata(get_page_text(page_index), get_page_text(page_index + 1))
 
 # --- Tool Definitions ---
-# Move all functions decorated with @tool here:
-# - read_consecutive_pages
-# - search_for_similar_cases
-# - ask_human_for_confirmation
-# - save_document
+
+# Source PDF parsed once per (path, mtime); save_document is called once per
+# detected document and re-parsing the whole source xref each time was the
+# bulk of its cost. A changed mtime invalidates the cached handle. pikepdf
+# (QPDF, C++) clones pages as xref references instead of walking page
+# objects through Python dicts like PyPDF2 did.
+_SRC_PDF_CACHE = {}
+
+def _get_source_pdf(path: str) -> pikepdf.Pdf:
+    key = (path, os.path.getmtime(path))
+    if key not in _SRC_PDF_CACHE:
+        for stale in _SRC_PDF_CACHE.values():
+            stale.close()
+        _SRC_PDF_CACHE.clear()
+        _SRC_PDF_CACHE[key] = pikepdf.Pdf.open(path)
+    return _SRC_PDF_CACHE[key]
+
+# All page texts, extracted once per run. Extraction is the most expensive
+# non-LLM operation, and the agent revisits every page at least twice, so a
+# single upfront pass replaces O(N) duplicated parses with list indexing.
+_PAGE_TEXTS = None
+
+def preload_pages() -> List[str]:
+    """
+    Extracts the text of every page once and caches the result for the rest
+    of the run. Extraction runs serially: PDFium is not thread-safe, and
+    upstream supports only one thread at a time even with a separate
+    document handle per worker, so the one-off pass stays single-threaded
+    — pypdfium2's C-backed extraction keeps it fast regardless.
+    Subsequent calls return the cached list.
+
+    Returns:
+        List[str]: Extracted text per page, in page order.
+    """
+    global _PAGE_TEXTS
+    if _PAGE_TEXTS is None:
+        pdf = pdfium.PdfDocument(CFG.pdf_path)
+        try:
+            _PAGE_TEXTS = [
+                pdf[i].get_textpage().get_text_range() for i in range(len(pdf))
+            ]
+        finally:
+            pdf.close()
+    return _PAGE_TEXTS
+
+def get_page_text(page_index: int) -> str:
+    """
+    Returns the extracted text of a single page, or an empty string if the
+    index is out of bounds.
+
+    Args:
+        page_index (int): Zero-based index of the page to extract.
+
+    Returns:
+        str: Text content of the page.
+    """
+    try:
+        pages = preload_pages()
+        if 0 <= page_index < len(pages):
+            return pages[page_index]
+        return ""
+    except Exception as e:
+        return f"Error reading page {page_index}: {e}"
+
 
 def read_consecutive_pages(current_page_index: int) -> str:
     """
@@ -55,30 +332,93 @@ def read_consecutive_pages(current_page_index: int) -> str:
     Returns:
         str: Combined text content of the current and next page, or an error message if out of bounds.
     """
-    content = ""
+    # Models often re-issue the same read within a document, so the fully
+    # formatted string is memoized; the mtime key drops stale entries if
+    # the source PDF changes between runs.
     try:
-        print(f"[DEBUG] Reading PDF: {config.PDF_PATH}, pages: {current_page_index}, {current_page_index + 1}")
-        reader = PdfReader(config.PDF_PATH)
-        # Read current page
-        if 0 <= current_page_index < len(reader.pages):
-            page_text = reader.pages[current_page_index].extract_text()
-            # print(f"[DEBUG] Extracted text (page {current_page_index}): {page_text}")
-            content += f"--- Page {current_page_index + 1} Content ---\n{page_text}\n\n"
-        else:
+        mtime = os.path.getmtime(CFG.pdf_path)
+    except OSError:
+        mtime = 0.0
+    return _read_consecutive_cached(current_page_index, mtime)
+
+
+@lru_cache(maxsize=256)
+def _read_consecutive_cached(current_page_index: int, mtime: float) -> str:
+    try:
+        pages = preload_pages()
+        total_pages = len(pages)
+        if not 0 <= current_page_index < total_pages:
             return f"Error: Current page index {current_page_index} is out of bounds."
 
-        # Read next page
-        if current_page_index + 1 < len(reader.pages):
-            next_page_text = reader.pages[current_page_index + 1].extract_text()
-            # print(f"[DEBUG] Extracted text (page {current_page_index + 1}): {next_page_text}")
-            content += f"--- Page {current_page_index + 2} Content ---\n{next_page_text}"
+        # Collect parts and join once: += on str reallocates the whole
+        # buffer, which adds up with full-page texts.
+        parts = [f"--- Page {current_page_index + 1} Content ---\n{pages[current_page_index]}\n\n"]
+        if current_page_index + 1 < total_pages:
+            parts.append(f"--- Page {current_page_index + 2} Content ---\n{pages[current_page_index + 1]}")
         else:
-            content += "--- End of Document ---"
-        return content
+            parts.append("--- End of Document ---")
+        # Piggyback lexically extracted metadata on the same tool turn so
+        # the model never needs a separate extraction round-trip.
+        metadata = _page_metadata(current_page_index)
+        parts.append(f"\n\n--- Metadata ---\n{orjson.dumps(metadata).decode()}")
+        return "".join(parts)
     except Exception as e:
         return f"Error reading PDF pages: {e}"
 
 
+# Local semantic cache for similarity searches: consecutive page pairs are
+# often near-identical (page i+1 becomes page i), so a cosine check against
+# recent query embeddings turns a remote Atlas round-trip into a NumPy dot
+# product. Embeddings are L2-normalized on insert so cosine == dot.
+_QCACHE: List[tuple] = []  # (normalized float32 embedding, result string)
+_QCACHE_MAX = 256
+_QCACHE_THRESHOLD = 0.92
+# Keys stacked once into a (C, D) float32 matrix so each lookup is a single
+# BLAS matrix-vector product; rebuilt lazily because lookups far outnumber
+# inserts.
+_QCACHE_KEYS: Optional[np.ndarray] = None
+# Tool-pool workers hit the cache concurrently; without the lock a FIFO
+# eviction between another thread's score and index steps would shift the
+# list and return the result cached for a different query.
+_QCACHE_LOCK = threading.Lock()
+
+# MongoClient and the vector store are built lazily once per process;
+# reconnecting per search paid SRV resolution, TLS and auth every call.
+_MONGO_CLIENT = None
+_VECTOR_STORE = None
+
+def _vector_store() -> Optional[MongoDBAtlasVectorSearch]:
+    global _MONGO_CLIENT, _VECTOR_STORE
+    if _VECTOR_STORE is None and CFG.mongo_uri:
+        _MONGO_CLIENT = MongoClient(CFG.mongo_uri, maxPoolSize=20)
+        _VECTOR_STORE = MongoDBAtlasVectorSearch(
+            collection=_MONGO_CLIENT[CFG.db_name][CFG.collection_name],
+            embedding=EMBEDDINGS,
+            index_name=CFG.vector_index_name,
+        )
+    return _VECTOR_STORE
+
+def _qcache_lookup(query_vec: np.ndarray) -> Optional[str]:
+    global _QCACHE_KEYS
+    with _QCACHE_LOCK:
+        if not _QCACHE:
+            return None
+        if _QCACHE_KEYS is None:
+            _QCACHE_KEYS = np.stack([vec for vec, _ in _QCACHE])
+        scores = _QCACHE_KEYS @ query_vec
+        best = int(np.argmax(scores))
+        if scores[best] >= _QCACHE_THRESHOLD:
+            return _QCACHE[best][1]
+        return None
+
+def _qcache_insert(query_vec: np.ndarray, result: str) -> None:
+    global _QCACHE_KEYS
+    with _QCACHE_LOCK:
+        _QCACHE.append((query_vec, result))
+        if len(_QCACHE) > _QCACHE_MAX:
+            del _QCACHE[0]
+        _QCACHE_KEYS = None
+
 def search_for_similar_cases(current_page_text: str, next_page_text: str) -> str:
     """
     Searches the vector store for similar past cases to aid in document splitting decisions.
@@ -90,21 +430,27 @@ def search_for_similar_cases(current_page_text: str, next_page_text: str) -> str
     Returns:
         str: Description of the most similar past case and its decision, or a message if none found.
     """
-    if not config.MONGO_URI:
+    if not CFG.mongo_uri:
         return "MongoDB URI not configured. Cannot search for similar cases."
     try:
-        client = MongoClient(config.MONGO_URI)
-        collection = client[config.DB_NAME][config.COLLECTION_NAME]
-        vector_store = MongoDBAtlasVectorSearch(
-            collection=collection, embedding=EMBEDDINGS, index_name=config.VECTOR_INDEX_NAME
-        )
         combined_query = f"Current Page:\n{current_page_text}\n\nNext Page:\n{next_page_text}"
-        docs = vector_store.similarity_search_with_score(combined_query, k=1)
+        query_vec = np.asarray(EMBEDDINGS.embed_query(combined_query), dtype=np.float32)
+        norm = np.linalg.norm(query_vec)
+        if norm > 0:
+            query_vec /= norm
+        cached_result = _qcache_lookup(query_vec)
+        if cached_result is not None:
+            return cached_result
+
+        docs = _vector_store().similarity_search_with_score(combined_query, k=1)
         if docs:
             doc, score = docs[0]
             past_decision = doc.metadata.get('decision', 'unknown')
-            return f"Found a similar case with score {score:.2f}. The past human decision was: '{past_decision}'."
-        return "No similar cases found."
+            result = f"Found a similar case with score {score:.2f}. The past human decision was: '{past_decision}'."
+        else:
+            result = "No similar cases found."
+        _qcache_insert(query_vec, result)
+        return result
     except Exception as e:
         return f"Failed to search for similar cases: {e}"
 
@@ -145,19 +491,18 @@ def save_document(page_indices: List[int], company: str, date: str, title: str)
         return "Error: No page indices provided to save."
     try:
         # Sanitize filename components
-        sanitized_company = re.sub(r'[\W_]+', '_', company)
-        sanitized_title = re.sub(r'[\W_]+', '_', title)
+        sanitized_company = _SANITIZE_RE.sub('_', company)
+        sanitized_title = _SANITIZE_RE.sub('_', title)
         filename = f"{date}-{sanitized_company}-{sanitized_title}.pdf"
-        output_path = os.path.join(config.OUTPUT_DIR, filename)
-
-        pdf_writer = PdfWriter()
-        pdf_reader = PdfReader(config.PDF_PATH)
-        for page_num in page_indices:
-            pdf_writer.add_page(pdf_reader.pages[page_num])
-        
-        with open(output_path, "wb") as f:
-            pdf_writer.write(f)
-        
+        output_path = os.path.join(CFG.output_dir, filename)
+
+        src = _get_source_pdf(CFG.pdf_path)
+        with pikepdf.Pdf.new() as out:
+            # One extend call copies the whole range inside QPDF instead of
+            # crossing the Python/C++ boundary once per page.
+            out.pages.extend(src.pages[i] for i in page_indices)
+            out.save(output_path)
+
         return f"Successfully saved document to: {output_path}"
     except Exception as e:
         return f"Error saving PDF to {output_path}: {e}"
\ No newline at end of file